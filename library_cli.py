@@ -9,83 +9,198 @@ Set environment variables:
     SUPABASE_URL, SUPABASE_KEY
 """
 
+import asyncio
+import csv
 import os
+import shlex
 import sys
+import httpx
+from postgrest import APIError
 from supabase import create_client
+from supabase.client import ClientOptions
+from collections import Counter
 from datetime import datetime, timedelta
+from functools import lru_cache
 
 SUPABASE_URL = os.getenv("SUPABASE_URL") or "https://YOUR_PROJECT_REF.supabase.co"
 SUPABASE_KEY = os.getenv("SUPABASE_KEY") or "YOUR_SERVICE_ROLE_KEY"
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Shared HTTP client with an explicit keepalive pool so repeated commands
+# reuse TCP+TLS connections instead of handshaking per request.
+_http_client = httpx.Client(
+    limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=30.0),
+    timeout=10.0,
+)
+
+supabase = create_client(SUPABASE_URL, SUPABASE_KEY, options=ClientOptions(httpx_client=_http_client))
+
+# Precomputed request shape for the hottest REPL command: the URL and headers
+# never change between calls, so skip rebuilding the query builder each time.
+_REST_HEADERS = {
+    "apikey": SUPABASE_KEY,
+    "Authorization": f"Bearer {SUPABASE_KEY}",
+}
+_LIST_BOOKS_URL = f"{SUPABASE_URL}/rest/v1/books?select=book_id,title,author,stock&order=book_id"
 
 
 def add_member(name: str, email: str):
-    resp = supabase.table("members").insert({"name": name, "email": email}).execute()
-    if resp.error:
-        print("Error:", resp.error)
-    else:
-        print("Member added:", resp.data)
+    try:
+        resp = supabase.table("members").insert({"name": name, "email": email}).execute()
+    except APIError as e:
+        print("Error:", e.message)
+        return
+    print("Member added:", resp.data)
 
 
 def add_book(title: str, author: str, category: str = None, stock: int = 1):
     row = {"title": title, "author": author, "category": category, "stock": stock}
-    resp = supabase.table("books").insert(row).execute()
-    if resp.error:
-        print("Error:", resp.error)
-    else:
-        print("Book added:", resp.data)
+    try:
+        resp = supabase.table("books").insert(row).execute()
+    except APIError as e:
+        print("Error:", e.message)
+        return
+    print("Book added:", resp.data)
 
 
-def list_books():
-    resp = supabase.table("books").select("*").order("book_id").execute()
-    if resp.error:
-        print("Error:", resp.error)
+def add_books_bulk(rows, chunk_size: int = 500):
+    # Multi-row insert: one round-trip per chunk instead of one per book.
+    total = 0
+    for i in range(0, len(rows), chunk_size):
+        chunk = rows[i:i + chunk_size]
+        try:
+            resp = supabase.table("books").insert(chunk).execute()
+        except APIError as e:
+            print(f"Error inserting rows {i}-{i + len(chunk) - 1}:", e.message)
+            return
+        total += len(resp.data)
+    print(f"Inserted {total} books.")
+
+
+def add_books_csv(path: str):
+    # CSV columns: title, author, category, stock
+    rows = []
+    with open(path, newline="") as f:
+        for r in csv.DictReader(f):
+            rows.append({
+                "title": r["title"],
+                "author": r["author"],
+                "category": r.get("category") or None,
+                "stock": int(r.get("stock") or 1),
+            })
+    if not rows:
+        print("No rows found in", path)
         return
+    add_books_bulk(rows)
+
+
+def iter_table(name: str, columns: str, page_size: int = 1000, modify=None):
+    # Page through a table with .range and yield rows one at a time, so only
+    # one page is ever resident and printing overlaps network I/O.
+    offset = 0
+    while True:
+        q = supabase.table(name).select(columns)
+        if modify:
+            q = modify(q)
+        try:
+            resp = q.range(offset, offset + page_size - 1).execute()
+        except APIError as e:
+            print("Error:", e.message)
+            return
+        for r in resp.data:
+            yield r
+        if len(resp.data) < page_size:
+            return
+        offset += page_size
+
+
+def list_books(page_size: int = 1000):
+    # Direct GET against the precomputed URL on the pooled client; pages via
+    # PostgREST offset/limit params like iter_table does.
     print("Books:")
-    for r in resp.data:
-        print(f"{r['book_id']:3} | {r['title'][:40]:40} | {r['author'][:20]:20} | stock: {r.get('stock',0)}")
+    offset = 0
+    while True:
+        resp = _http_client.get(f"{_LIST_BOOKS_URL}&offset={offset}&limit={page_size}", headers=_REST_HEADERS)
+        if resp.status_code >= 400:
+            print("Error:", resp.text)
+            return
+        rows = resp.json()
+        for r in rows:
+            print(f"{r['book_id']:3} | {r['title'][:40]:40} | {r['author'][:20]:20} | stock: {r.get('stock',0)}")
+        if len(rows) < page_size:
+            return
+        offset += page_size
 
 
 def search_books(q: str):
-    # simple ilike search on title/author/category (Postgres)
+    # single ilike on the generated search_blob column (title+author+category),
+    # served by the trigram GIN index in schema.sql
     pattern = f"%{q}%"
-    resp = supabase.table("books").select("*").or_(f"title.ilike.{pattern},author.ilike.{pattern},category.ilike.{pattern}").execute()
-    if resp.error:
-        print("Error:", resp.error)
+    try:
+        resp = supabase.table("books").select("book_id,title,author,stock").ilike("search_blob", pattern).execute()
+    except APIError as e:
+        print("Error:", e.message)
         return
     print("Search results:")
     for r in resp.data:
         print(f"{r['book_id']:3} | {r['title'][:40]:40} | {r['author'][:20]:20} | stock: {r.get('stock',0)}")
 
 
-def show_member(member_id: int):
-    mem = supabase.table("members").select("*").eq("member_id", member_id).single().execute()
-    if mem.error:
-        print("Error:", mem.error)
-        return
-    if not mem.data:
-        print("Member not found")
+async def show_member(member_id: int):
+    # The member lookup and the borrow-records fetch are independent, so run
+    # them concurrently: wall-clock cost is max(RTT1, RTT2) instead of the sum.
+    def fetch_member():
+        return supabase.table("members").select("member_id,name,email").eq("member_id", member_id).single().execute()
+
+    def fetch_records():
+        # list borrowed books (active and history)
+        return list(iter_table(
+            "borrow_records",
+            "record_id, book_id, borrow_date, return_date, books(title,author)",
+            modify=lambda q: q.eq("member_id", member_id).order("borrow_date", desc=False),
+        ))
+
+    try:
+        mem, records = await asyncio.gather(
+            asyncio.to_thread(fetch_member),
+            asyncio.to_thread(fetch_records),
+        )
+    except APIError as e:
+        # PGRST116: .single() matched zero rows, i.e. no such member.
+        if e.code == "PGRST116":
+            print("Member not found")
+        else:
+            print("Error:", e.message)
         return
     print("Member:", mem.data)
-    # list borrowed books (active and history)
-    resp = supabase.table("borrow_records").select("record_id, book_id, borrow_date, return_date, books(title,author)").eq("member_id", member_id).order("borrow_date", desc=False).execute()
-    if resp.error:
-        print("Error fetching borrow records:", resp.error)
-        return
     print("Borrow records:")
-    for r in resp.data:
+    for r in records:
         title = r.get("books", {}).get("title") if r.get("books") else None
         status = "Returned" if r.get("return_date") else "Borrowed"
         print(f"  record {r['record_id']:3} | book {r['book_id']:3} | {title or 'N/A'} | {r['borrow_date']} -> {r['return_date']} | {status}")
 
 
+@lru_cache(maxsize=1024)
+def _get_book(book_id: int):
+    # Session-scoped memo for per-id book lookups; invalidated on writes
+    # via _get_book.cache_clear() so reports never print stale titles.
+    try:
+        resp = supabase.table("books").select("title,author").eq("book_id", book_id).single().execute()
+    except APIError:
+        return None, None
+    if not resp.data:
+        return None, None
+    return resp.data.get("title"), resp.data.get("author")
+
+
 def update_book_stock(book_id: int, new_stock: int):
-    resp = supabase.table("books").update({"stock": new_stock}).eq("book_id", book_id).execute()
-    if resp.error:
-        print("Error:", resp.error)
-    else:
-        print("Updated:", resp.data)
+    try:
+        resp = supabase.table("books").update({"stock": new_stock}).eq("book_id", book_id).execute()
+    except APIError as e:
+        print("Error:", e.message)
+        return
+    finally:
+        _get_book.cache_clear()
+    print("Updated:", resp.data)
 
 
 def update_member_info(member_id: int, name: str = None, email: str = None):
@@ -97,89 +212,120 @@ def update_member_info(member_id: int, name: str = None, email: str = None):
     if not payload:
         print("Nothing to update.")
         return
-    resp = supabase.table("members").update(payload).eq("member_id", member_id).execute()
-    if resp.error:
-        print("Error:", resp.error)
-    else:
-        print("Updated member:", resp.data)
+    try:
+        resp = supabase.table("members").update(payload).eq("member_id", member_id).execute()
+    except APIError as e:
+        print("Error:", e.message)
+        return
+    print("Updated member:", resp.data)
 
 
 def delete_member(member_id: int):
-    # allow deletion only if no active borrows (no borrow_records with return_date IS NULL)
-    resp = supabase.table("borrow_records").select("*").eq("member_id", member_id).is_("return_date", "null").execute()
-    if resp.error:
-        print("Error checking borrow records:", resp.error)
+    # safe_delete_member (see schema.sql) checks for active borrows and
+    # deletes in one transaction: one round-trip, no TOCTOU window.
+    try:
+        resp = supabase.rpc("safe_delete_member", {"p_member_id": member_id}).execute()
+    except APIError as e:
+        print("Error deleting member:", e.message)
         return
-    if resp.data:
+    if resp.data == "active_borrow":
         print("Cannot delete: member has active borrowed books.")
-        return
-    resp2 = supabase.table("members").delete().eq("member_id", member_id).execute()
-    if resp2.error:
-        print("Error deleting member:", resp2.error)
     else:
-        print("Member deleted:", resp2.data)
+        print("Member deleted.")
 
 
 def delete_book(book_id: int):
-    # allow deletion only if no borrow_records referencing it
-    resp = supabase.table("borrow_records").select("*").eq("book_id", book_id).execute()
-    if resp.error:
-        print("Error checking borrow records:", resp.error)
+    # safe_delete_book (see schema.sql) checks borrow history and deletes atomically.
+    try:
+        resp = supabase.rpc("safe_delete_book", {"p_book_id": book_id}).execute()
+    except APIError as e:
+        print("Error deleting book:", e.message)
         return
-    if resp.data:
+    finally:
+        _get_book.cache_clear()
+    if resp.data == "has_history":
         print("Cannot delete: book has borrow history. Consider setting stock to 0 or archiving.")
-        return
-    resp2 = supabase.table("books").delete().eq("book_id", book_id).execute()
-    if resp2.error:
-        print("Error deleting book:", resp2.error)
     else:
-        print("Book deleted:", resp2.data)
+        print("Book deleted.")
 
 
 def borrow_book(member_id: int, book_id: int):
     # Call the RPC function we created: borrow_book(p_member_id int, p_book_id int)
-    resp = supabase.rpc("borrow_book", {"p_member_id": member_id, "p_book_id": book_id}).execute()
-    if resp.error:
-        print("Error borrowing book:", resp.error)
-    else:
-        print("Borrow successful:", resp.data)
+    # It raises 'out of stock' when the conditional UPDATE touched no row.
+    try:
+        resp = supabase.rpc("borrow_book", {"p_member_id": member_id, "p_book_id": book_id}).execute()
+    except APIError as e:
+        print("Error borrowing book:", e.message)
+        return
+    print("Borrow successful:", resp.data)
 
 
 def return_book(record_id: int):
-    resp = supabase.rpc("return_book", {"p_record_id": record_id}).execute()
-    if resp.error:
-        print("Error returning book:", resp.error)
-    else:
-        print("Return successful:", resp.data)
+    try:
+        resp = supabase.rpc("return_book", {"p_record_id": record_id}).execute()
+    except APIError as e:
+        print("Error returning book:", e.message)
+        return
+    print("Return successful:", resp.data)
 
 
 def report_overdue(days: int = 14):
     cutoff = (datetime.utcnow() - timedelta(days=days)).isoformat()
-    # borrow_records with return_date IS NULL and borrow_date < cutoff
-    resp = supabase.table("borrow_records").select("record_id, member_id, book_id, borrow_date, members(name), books(title)").is_("return_date", "null").lt("borrow_date", cutoff).execute()
-    if resp.error:
-        print("Error:", resp.error)
-        return
+    # v_overdue (see schema.sql) pre-joins members/books over active borrows,
+    # backed by a partial index on borrow_date WHERE return_date IS NULL.
     print(f"Overdue (borrowed before {cutoff}):")
-    for r in resp.data:
-        print(f"{r['record_id']:4} | member {r['member_id']} {r.get('members',{}).get('name')} | book {r['book_id']} {r.get('books',{}).get('title')} | borrowed {r['borrow_date']}")
+    for r in iter_table("v_overdue", "*", modify=lambda q: q.lt("borrow_date", cutoff)):
+        print(f"{r['record_id']:4} | member {r['member_id']} {r.get('member_name')} | book {r['book_id']} {r.get('book_title')} | borrowed {r['borrow_date']}")
 
 
 def report_most_borrowed(limit: int = 10):
-    # Use Postgres aggregation via RPC? Simple approach: query borrow_records and aggregate client-side by book
-    resp = supabase.table("borrow_records").select("book_id").execute()
-    if resp.error:
-        print("Error:", resp.error)
+    # Aggregate in Postgres via the most_borrowed_books RPC (see schema.sql):
+    # one round-trip instead of scanning borrow_records client-side and
+    # fetching each top book individually.
+    try:
+        resp = supabase.rpc("most_borrowed_books", {"p_limit": limit}).execute()
+    except APIError as e:
+        # PGRST202: function not found, i.e. the RPC isn't deployed yet --
+        # fall back to client-side aggregation. Anything else is a real error.
+        if e.code == "PGRST202":
+            _report_most_borrowed_fallback(limit)
+        else:
+            print("Error:", e.message)
         return
-    counts = {}
+    print("Most borrowed books:")
     for r in resp.data:
-        counts[r["book_id"]] = counts.get(r["book_id"], 0) + 1
-    items = sorted(counts.items(), key=lambda x: x[1], reverse=True)[:limit]
+        title = r.get("title") or "Unknown"
+        print(f"{r['book_id']:3} | {title[:50]:50} | borrowed {r['cnt']} times")
+
+
+def _report_most_borrowed_fallback(limit: int = 10):
+    # Client-side aggregation; fetches the top books with a single IN query
+    # rather than one SELECT per book.
+    try:
+        resp = supabase.table("borrow_records").select("book_id").execute()
+    except APIError as e:
+        print("Error:", e.message)
+        return
+    # Counter counts in C and most_common top-ks via a heap: O(N log k)
+    # instead of sorting every distinct book.
+    items = Counter(r["book_id"] for r in resp.data).most_common(limit)
+    if not items:
+        print("Most borrowed books:")
+        return
+    ids = [book_id for book_id, _ in items]
+    try:
+        books = supabase.table("books").select("book_id,title,author").in_("book_id", ids).execute()
+    except APIError as e:
+        print("Error:", e.message)
+        return
+    bmap = {b["book_id"]: b for b in books.data}
     print("Most borrowed books:")
     for book_id, cnt in items:
-        b = supabase.table("books").select("title, author").eq("book_id", book_id).single().execute()
-        title = b.data.get("title") if b.data else "Unknown"
-        print(f"{book_id:3} | {title[:50]:50} | borrowed {cnt} times")
+        if book_id in bmap:
+            title = bmap[book_id].get("title")
+        else:
+            title, _ = _get_book(book_id)
+        print(f"{book_id:3} | {(title or 'Unknown')[:50]:50} | borrowed {cnt} times")
 
 
 def print_help():
@@ -187,6 +333,7 @@ def print_help():
 Available commands:
   add_member <name> <email>
   add_book <title> <author> <category> <stock>
+  add_books_csv <path>
   list_books
   search_books <query>
   show_member <member_id>
@@ -213,7 +360,12 @@ def main_loop():
             break
         if not cmd:
             continue
-        parts = cmd.split()
+        try:
+            # shlex keeps quoted args intact: add_book "The Great Gatsby" ...
+            parts = shlex.split(cmd)
+        except ValueError as e:
+            print("Parse error:", e)
+            continue
         name = parts[0].lower()
         args = parts[1:]
 
@@ -221,18 +373,20 @@ def main_loop():
             if name == "add_member":
                 add_member(args[0], args[1])
             elif name == "add_book":
-                # title and author may contain spaces; naive parsing:
+                # quote title/author if they contain spaces
                 if len(args) < 4:
                     print("Usage: add_book <title> <author> <category> <stock>")
                 else:
                     title, author, category, stock = args[0], args[1], args[2], int(args[3])
                     add_book(title, author, category, stock)
+            elif name == "add_books_csv":
+                add_books_csv(args[0])
             elif name == "list_books":
                 list_books()
             elif name == "search_books":
                 search_books(" ".join(args))
             elif name == "show_member":
-                show_member(int(args[0]))
+                asyncio.run(show_member(int(args[0])))
             elif name == "update_book_stock":
                 update_book_stock(int(args[0]), int(args[1]))
             elif name == "update_member_info":
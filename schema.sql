@@ -0,0 +1,84 @@
+-- schema.sql
+-- SQL objects used by library_cli.py. Run these in the Supabase SQL editor.
+
+-- Top-K most borrowed books, aggregated server-side in a single query.
+CREATE OR REPLACE FUNCTION most_borrowed_books(p_limit int)
+RETURNS TABLE(book_id int, title text, author text, cnt bigint)
+LANGUAGE sql STABLE AS $$
+    SELECT b.book_id, b.title, b.author, count(*)
+    FROM borrow_records br
+    JOIN books b ON b.book_id = br.book_id
+    GROUP BY b.book_id
+    ORDER BY 4 DESC
+    LIMIT p_limit
+$$;
+
+-- Overdue report: partial index over active borrows plus a flattened view,
+-- so the report is a single index scan with no embedded-resource lookups.
+CREATE INDEX IF NOT EXISTS borrow_records_active_idx
+    ON borrow_records (borrow_date)
+    WHERE return_date IS NULL;
+
+CREATE OR REPLACE VIEW v_overdue AS
+    SELECT br.record_id, br.member_id, br.book_id, br.borrow_date,
+           m.name AS member_name, b.title AS book_title
+    FROM borrow_records br
+    JOIN members m USING (member_id)
+    JOIN books b USING (book_id)
+    WHERE br.return_date IS NULL;
+
+-- Atomic reference-check + delete: one round-trip, no window for a borrow
+-- to slip in between the check and the delete.
+CREATE OR REPLACE FUNCTION safe_delete_member(p_member_id int)
+RETURNS text LANGUAGE plpgsql AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM borrow_records
+               WHERE member_id = p_member_id AND return_date IS NULL) THEN
+        RETURN 'active_borrow';
+    END IF;
+    DELETE FROM members WHERE member_id = p_member_id;
+    RETURN 'ok';
+END $$;
+
+CREATE OR REPLACE FUNCTION safe_delete_book(p_book_id int)
+RETURNS text LANGUAGE plpgsql AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM borrow_records WHERE book_id = p_book_id) THEN
+        RETURN 'has_history';
+    END IF;
+    DELETE FROM books WHERE book_id = p_book_id;
+    RETURN 'ok';
+END $$;
+
+-- Trigram-indexed search: a generated search_blob column plus a GIN index
+-- lets the '%q%' search use an index bitmap instead of scanning every row.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE books ADD COLUMN IF NOT EXISTS search_blob text
+    GENERATED ALWAYS AS (title || ' ' || author || ' ' || coalesce(category, '')) STORED;
+
+CREATE INDEX IF NOT EXISTS books_trgm_idx
+    ON books USING GIN (search_blob gin_trgm_ops);
+
+-- Borrow as a single atomic statement: the conditional UPDATE both checks
+-- and decrements stock, so there is no read-modify-write window and
+-- concurrent borrows of the same book don't serialize on a prior SELECT.
+-- Raises when the book is out of stock so callers see a failure, not NULL.
+CREATE OR REPLACE FUNCTION borrow_book(p_member_id int, p_book_id int)
+RETURNS int LANGUAGE plpgsql AS $$
+DECLARE
+    v_record_id int;
+BEGIN
+    WITH upd AS (
+        UPDATE books SET stock = stock - 1
+        WHERE book_id = p_book_id AND stock > 0
+        RETURNING book_id
+    )
+    INSERT INTO borrow_records (member_id, book_id, borrow_date)
+    SELECT p_member_id, book_id, now() FROM upd
+    RETURNING record_id INTO v_record_id;
+    IF v_record_id IS NULL THEN
+        RAISE EXCEPTION 'out of stock';
+    END IF;
+    RETURN v_record_id;
+END $$;